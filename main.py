@@ -5,16 +5,29 @@ import aiohttp
 import os
 import asyncio
 import logging
-import json
 import math
+import re
+import bisect
+import concurrent.futures
+import functools
+import heapq
+import hashlib
+import copy
+import itertools
+import contextlib
+import time
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 from typing import Optional, List, Tuple
 from collections import defaultdict
+from dataclasses import dataclass, field
 
 # --- 外部库引入 ---
 import tenacity  # 用于 DeepSeek 重试
 from cachetools import TTLCache  # 用于 FMP 本地缓存
+from aiolimiter import AsyncLimiter  # 用于 FMP 令牌桶限速
+import orjson  # 更快的 JSON 编解码
+import diskcache  # FMP 缓存落盘，重启后仍可命中
 
 # 加载环境变量
 load_dotenv()
@@ -30,18 +43,105 @@ DEEPSEEK_URL = "https://api.deepseek.com/chat/completions"
 # --- 全局状态 ---
 PRIVACY_MODE = {}
 
+# --- 按 key 串行化的锁表 ---
+# key 来自用户输入的 ticker，不能用 defaultdict 常驻；没有持有者和等待者时立即移除
+class KeyedLocks:
+    def __init__(self):
+        self._entries = {}  # key -> [asyncio.Lock, 持有 + 等待的协程数]
+
+    @contextlib.asynccontextmanager
+    async def lock(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
+
 # --- 全局缓存 (FMP) ---
 # maxsize=2000: 最多缓存2000个请求结果
 # ttl=600: 数据有效期 600秒 (10分钟)，期间重复查询不消耗 FMP 额度
 FMP_CACHE = TTLCache(maxsize=2000, ttl=600)
+# 财报 / TTM 指标 / 分析师预期按日更新，单独放进 1 小时的缓存
+FMP_SLOW_CACHE = TTLCache(maxsize=2000, ttl=3600)
+FMP_SLOW_ENDPOINTS = frozenset((
+    "key-metrics-ttm", "ratios-ttm", "financial-growth", "balance-sheet-statement", "analyst-estimates"
+))
+# 内存缓存之下的磁盘层 (SQLite)，过期时间与所在内存缓存的 TTL 一致，上限 100MB
+# key 使用脱敏后的 URL，避免 API key 落盘
+FMP_DISK_CACHE = diskcache.Cache(os.getenv("FMP_CACHE_DIR", "./fmp_cache"), size_limit=100 * 1024 * 1024)
+
+# --- 公司静态信息缓存 ---
+# sector/industry/beta 等字段极少变化，按 ticker 缓存 7 天
+# 命中后直接用 /quote 的价格与市值拼出 profile，省掉一次 profile 请求
+PROFILE_STATIC_CACHE = TTLCache(maxsize=8192, ttl=7 * 86400)
+PROFILE_STATIC_FIELDS = ("symbol", "companyName", "sector", "industry", "beta", "description", "image")
+
+# --- 宏观数据缓存 (10Y 美债 / VIX) ---
+# 与个股无关、所有查询共享，单独按更短的 TTL 缓存: key -> (写入时间, 数据)
+MACRO_CACHE = {}
+MACRO_LOCKS = KeyedLocks()
+TREASURY_TTL = 300
+VIX_TTL = 60
+
+# --- DeepSeek 结果缓存 ---
+# key: (ticker, 上下文摘要)；数据没变时 15 分钟内直接复用，不重复调用付费接口
+AI_CACHE = TTLCache(maxsize=512, ttl=900)
+# 同一 ticker 的并发请求串行化，后到的请求直接命中缓存
+AI_LOCKS = KeyedLocks()
+
+# --- 分析结果缓存 ---
+# 热门 ticker 2 分钟内复用 fetch_data + analyze 的结果: ticker -> (model, data)
+ANALYSIS_CACHE = TTLCache(maxsize=256, ttl=120)
+ANALYSIS_LOCKS = KeyedLocks()
+
+# --- 成品 embed 缓存 ---
+# 只缓存 AI 策略生成成功的完整结果: ticker -> embed.to_dict()
+EMBED_CACHE = TTLCache(maxsize=512, ttl=300)
+
+# --- 字段投影 ---
+# 大数组接口只保留 analyze / DeepSeek 实际读取的字段，减少缓存占用
+CF_KEEP = frozenset(("date", "netCashProvidedByOperatingActivities", "depreciationAndAmortization"))
+EARNINGS_KEEP = frozenset(("date", "revenueActual", "revenue", "epsActual", "epsEstimated"))
+ESTIMATES_KEEP = frozenset(("date", "epsAvg"))
+BS_KEEP = frozenset(("date", "cashAndCashEquivalents", "totalDebt", "commonStockSharesOutstanding"))
+
+# --- FMP 并发与限速 ---
+# 每次分析会并发 9+ 个 FMP 请求，多用户同时查询时容易触发 FMP 的 429
+# FMP_SEM: 同一时刻最多 20 个在途请求
+# FMP_RATE_LIMITER: 令牌桶，稳态不超过 300 次/分钟
+FMP_MAX_CONCURRENCY = 20
+FMP_RATE_PER_MIN = 300
+FMP_SEM = asyncio.Semaphore(FMP_MAX_CONCURRENCY)
+FMP_RATE_LIMITER = AsyncLimiter(FMP_RATE_PER_MIN, 60)
+
+# --- FMP URL 模板 ---
+# 端点集合固定，导入时把 BASE_URL / API key 拼好，调用时只填 ticker
+FMP_ENDPOINTS = (
+    "quote", "key-metrics-ttm", "ratios-ttm", "financial-growth",
+    "balance-sheet-statement", "cash-flow-statement"
+)
+FMP_URL_TMPL = {ep: f"{BASE_URL}/{ep}?symbol={{}}&apikey={FMP_API_KEY}" for ep in FMP_ENDPOINTS}
 
 # --- 白名单 ---
-HARD_TECH_TICKERS = ["RKLB", "LUNR", "ASTS", "SPCE", "PLTR", "IONQ", "RGTI", "DNA", "JOBY", "ACHR", "BABA", "NIO", "XPEV", "LI", "TSLA", "NVDA", "AMD", "MSFT", "GOOG", "GOOGL", "AMZN", "AAPL"]
+HARD_TECH_TICKERS = frozenset(["RKLB", "LUNR", "ASTS", "SPCE", "PLTR", "IONQ", "RGTI", "DNA", "JOBY", "ACHR", "BABA", "NIO", "XPEV", "LI", "TSLA", "NVDA", "AMD", "MSFT", "GOOG", "GOOGL", "AMZN", "AAPL"])
 
 # --- 关键词词典 ---
 BLUE_OCEAN_KEYWORDS = ["aerospace", "defense", "space", "satellite", "rocket", "quantum"]
 HARD_TECH_KEYWORDS = ["semiconductor", "artificial intelligence", "software", "auto", "biotech", "internet"]
 
+# 预编译为单个正则 (保持子串匹配语义，如 "auto" 命中 "Auto - Manufacturers")
+BLUE_OCEAN_RE = re.compile("|".join(map(re.escape, BLUE_OCEAN_KEYWORDS)), re.I)
+HARD_TECH_RE = re.compile("|".join(map(re.escape, HARD_TECH_KEYWORDS)), re.I)
+
 # --- 日志配置 ---
 logging.basicConfig(
     level=logging.INFO,
@@ -77,54 +177,175 @@ def is_rate_limited(user_id: int) -> Tuple[bool, str]:
     USER_CALLS[user_id].append(now)
     return False, ""
 
+# --- 日期工具 ---
+# 同一分钟内复用同一个 "YYYY-MM-DD" 字符串，避免每次分析都 strftime
+@functools.lru_cache(maxsize=1)
+def _ymd_for_minute(minute_bucket: int) -> str:
+    return datetime.now().strftime("%Y-%m-%d")
+
+def today_ymd() -> str:
+    return _ymd_for_minute(int(time.time() // 60))
+
+# 美债利率查询窗口 (近 7 天 ~ 今天)，同样按分钟缓存
+@functools.lru_cache(maxsize=1)
+def _treasury_window_for_minute(minute_bucket: int) -> Tuple[str, str]:
+    now = datetime.now()
+    return (now - timedelta(days=7)).strftime("%Y-%m-%d"), now.strftime("%Y-%m-%d")
+
+def treasury_window() -> Tuple[str, str]:
+    return _treasury_window_for_minute(int(time.time() // 60))
+
 # --- 1. 异步数据工具函数 (含缓存逻辑) ---
 
-async def get_json_safely(session: aiohttp.ClientSession, url: str):
+class RetryableHTTPError(aiohttp.ClientError):
+    """429 / 5xx 等瞬时错误，交给 tenacity 重试"""
+    def __init__(self, status: int, retry_after: Optional[str] = None):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.retry_after = retry_after
+
+def _is_retryable_status(status: int) -> bool:
+    return status == 429 or 500 <= status < 600
+
+_FMP_BACKOFF = tenacity.wait_exponential_jitter(initial=0.2, max=2)
+
+def _fmp_retry_wait(retry_state: tenacity.RetryCallState) -> float:
+    # 429 优先遵循服务端的 Retry-After，其余按指数退避 + 抖动 (约 0.2s / 0.5s / 1.5s)
+    exc = retry_state.outcome.exception() if retry_state.outcome else None
+    if isinstance(exc, RetryableHTTPError) and exc.retry_after:
+        try:
+            return min(float(exc.retry_after), 2.0)
+        except ValueError:
+            pass
+    return _FMP_BACKOFF(retry_state)
+
+def project_records(data, keep: frozenset):
+    if not isinstance(data, list):
+        return data
+    return [{k: v for k, v in row.items() if k in keep} if isinstance(row, dict) else row for row in data]
+
+async def _fetch_json_once(session: aiohttp.ClientSession, url: str, safe_url: str, keep: Optional[frozenset] = None, use_cache: bool = True, cache: TTLCache = FMP_CACHE):
+    async with FMP_SEM, FMP_RATE_LIMITER:
+        async with asyncio.timeout(10):
+            async with session.get(url) as response:
+                if _is_retryable_status(response.status):
+                    raise RetryableHTTPError(response.status, response.headers.get("Retry-After"))
+                if response.status != 200:
+                    logger.warning("API Status %s for %s", response.status, safe_url)
+                    return None
+                raw = await response.read()
+                if not raw:
+                    return None
+                try:
+                    data = orjson.loads(raw)
+                except orjson.JSONDecodeError:
+                    return None
+            
+                # FMP 有时会返回 {"Error Message": ...} 
+                if isinstance(data, dict) and "Error Message" in data:
+                    return None
+            
+                if keep:
+                    data = project_records(data, keep)
+
+                # 2. 写入缓存 (只有成功的数据才缓存)
+                if use_cache:
+                    cache[url] = data
+                return data
+
+async def get_json_safely(session: aiohttp.ClientSession, url: str, keep: Optional[frozenset] = None, use_cache: bool = True, cache: TTLCache = FMP_CACHE):
     # 1. 检查缓存
-    if url in FMP_CACHE:
-        return FMP_CACHE[url]
+    if use_cache and url in cache:
+        return cache[url]
 
     # --- 日志脱敏处理 ---
     # 即使 URL 里带 key，我们在打印日志时把它替换掉
     safe_url = url.replace(FMP_API_KEY, "******") if FMP_API_KEY else url
+
+    # 内存未命中时先查磁盘层 (进程重启后的冷启动)；不回填内存，避免把剩余有效期重新拉满
+    # SQLite 读写是阻塞调用，一律放到线程里执行，不占用事件循环
+    if use_cache:
+        data = await asyncio.to_thread(FMP_DISK_CACHE.get, safe_url)
+        if data is not None:
+            return data
     
+    # 仅对 429/5xx、连接错误和超时重试；4xx 等硬错误直接返回 None
+    retrying = tenacity.AsyncRetrying(
+        stop=tenacity.stop_after_attempt(3),
+        wait=_fmp_retry_wait,
+        retry=tenacity.retry_if_exception_type((aiohttp.ClientError, asyncio.TimeoutError)),
+        reraise=True
+    )
     try:
-        async with session.get(url, timeout=10) as response:
-            if response.status != 200:
-                logger.warning(f"API Status {response.status} for {safe_url}")
-                return None
-            try:
-                data = await response.json()
-            except Exception:
-                return None
-            
-            # FMP 有时会返回 {"Error Message": ...} 
-            if isinstance(data, dict) and "Error Message" in data:
-                return None
-            
-            # 2. 写入缓存 (只有成功的数据才缓存)
-            FMP_CACHE[url] = data
-            return data
+        async for attempt in retrying:
+            with attempt:
+                data = await _fetch_json_once(session, url, safe_url, keep, use_cache, cache)
+        # 落盘在释放 FMP_SEM / 限速令牌之后进行
+        if use_cache and data is not None:
+            await asyncio.to_thread(FMP_DISK_CACHE.set, safe_url, data, expire=cache.ttl)
+        return data
+    except RetryableHTTPError as e:
+        logger.warning("API Status %s for %s (retries exhausted)", e.status, safe_url)
+        return None
     except Exception:
-        logger.warning(f"Request failed for {safe_url}")
+        logger.warning("Request failed for %s", safe_url)
         return None
 
-async def get_treasury_rates(session: aiohttp.ClientSession):
-    today = datetime.now()
-    start_date = (today - timedelta(days=7)).strftime("%Y-%m-%d")
-    end_date = today.strftime("%Y-%m-%d")
+async def gather_within(coros, timeout: float) -> list:
+    # 并发执行一组协程，超时仍未完成的任务取消并记为 None，异常同样记为 None
+    # 与 asyncio.timeout 包住整个 gather 不同，已返回的结果不会因为个别慢接口被丢弃
+    tasks = [asyncio.ensure_future(c) for c in coros]
+    done, pending = await asyncio.wait(tasks, timeout=max(timeout, 0))
+    for t in pending:
+        t.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+    return [t.result() if t in done and t.exception() is None else None for t in tasks]
+
+async def get_macro_cached(key: str, ttl: float, fetcher):
+    entry = MACRO_CACHE.get(key)
+    if entry and time.monotonic() - entry[0] < ttl:
+        return entry[1]
+    # 加锁防止缓存过期瞬间多个查询同时回源
+    async with MACRO_LOCKS.lock(key):
+        entry = MACRO_CACHE.get(key)
+        if entry and time.monotonic() - entry[0] < ttl:
+            return entry[1]
+        # 重启后先查磁盘层；磁盘记录的是墙钟时间，换算成已过去的秒数再回填内存，剩余有效期不变
+        disk_key = f"macro:{key}"
+        disk_entry = await asyncio.to_thread(FMP_DISK_CACHE.get, disk_key)
+        if disk_entry:
+            age = time.time() - disk_entry[0]
+            if 0 <= age < ttl:
+                MACRO_CACHE[key] = (time.monotonic() - age, disk_entry[1])
+                return disk_entry[1]
+        data = await fetcher()
+        if data:
+            MACRO_CACHE[key] = (time.monotonic(), data)
+            await asyncio.to_thread(FMP_DISK_CACHE.set, disk_key, (time.time(), data), expire=ttl)
+        return data
+
+async def _fetch_treasury_rates(session: aiohttp.ClientSession):
+    start_date, end_date = treasury_window()
     url = f"{BASE_URL}/treasury-rates?from={start_date}&to={end_date}&apikey={FMP_API_KEY}"
-    data = await get_json_safely(session, url)
+    data = await get_json_safely(session, url, use_cache=False)
     if data and isinstance(data, list) and len(data) > 0:
         return data[0]
     return None
 
+async def get_treasury_rates(session: aiohttp.ClientSession):
+    return await get_macro_cached("treasury", TREASURY_TTL, lambda: _fetch_treasury_rates(session))
+
+async def get_vix_quote(session: aiohttp.ClientSession):
+    return await get_macro_cached("vix", VIX_TTL, lambda: get_fmp_data(session, "quote", "^VIX", "", use_cache=False))
+
 async def get_company_profile_smart(session: aiohttp.ClientSession, ticker: str):
     url_profile = f"{BASE_URL}/profile?symbol={ticker}&apikey={FMP_API_KEY}"
     data = await get_json_safely(session, url_profile)
     if data and isinstance(data, list) and len(data) > 0:
         return data[0]
         
+    # screener 只在 profile 落空时才请求，避免每次 profile 未缓存都多花一次 FMP 额度
     url_screener = f"{BASE_URL}/stock-screener?symbol={ticker}&apikey={FMP_API_KEY}"
     data_scr = await get_json_safely(session, url_screener)
     if data_scr and isinstance(data_scr, list) and len(data_scr) > 0:
@@ -142,43 +363,73 @@ async def get_company_profile_smart(session: aiohttp.ClientSession, ticker: str)
         }
     return None
 
-async def get_fmp_data(session: aiohttp.ClientSession, endpoint: str, ticker: str, params: str = ""):
-    url = f"{BASE_URL}/{endpoint}?symbol={ticker}&apikey={FMP_API_KEY}"
+async def get_fmp_data(session: aiohttp.ClientSession, endpoint: str, ticker: str, params: str = "", keep: Optional[frozenset] = None, use_cache: bool = True):
+    tmpl = FMP_URL_TMPL.get(endpoint)
+    url = tmpl.format(ticker) if tmpl else f"{BASE_URL}/{endpoint}?symbol={ticker}&apikey={FMP_API_KEY}"
     if params: url += f"&{params}"
-    return await get_json_safely(session, url)
+    cache = FMP_SLOW_CACHE if endpoint in FMP_SLOW_ENDPOINTS else FMP_CACHE
+    return await get_json_safely(session, url, keep, use_cache, cache)
 
 async def get_estimates_data(session: aiohttp.ClientSession, ticker: str):
     url = f"{BASE_URL}/analyst-estimates?symbol={ticker}&period=annual&limit=10&apikey={FMP_API_KEY}"
-    data = await get_json_safely(session, url)
+    data = await get_json_safely(session, url, ESTIMATES_KEEP, cache=FMP_SLOW_CACHE)
     return data if data else []
 
 async def get_earnings_data(session: aiohttp.ClientSession, ticker: str):
     url = f"{BASE_URL}/earnings?symbol={ticker}&apikey={FMP_API_KEY}"
-    data = await get_json_safely(session, url)
+    data = await get_json_safely(session, url, EARNINGS_KEEP)
     return data if data else []
 
 # --- 2. DeepSeek AI 策略生成 (稳如泰山版) ---
 
+# 与个股无关的部分在模块加载时构建一次，每次调用只拼接 user 消息
+DEEPSEEK_SYSTEM_PROMPT = (
+    "你是一位拥有十年经验的资深美股交易员和华尔街机构分析师。你精通基本面分析、估值建模和市场情绪判断。"
+    "你需要阅读我提供的精简财务数据包。"
+    "请用**专业、科学、辩证**的角度评估这些数据。"
+    "**要求：**"
+    "1. 字数严格限制在50字以内，简明扼要。"
+    "2. 不能单靠一个pe得出结论，不能单凭股价在高位就说估值高（特别是7大科技，股价高不代表贵），需要结合EV/EBITDA、PEG (Forward)、Adj FCF Yield、ROIC、PEG (TTM)等多种数据交叉验证，用华尔街看数据的方法，得出一个合理的评估结论，就像华尔街机构晨报那样， 语言风格要通俗易懂且专业。"
+    "3. 用白话的形式告诉用户现在的股价是个什么位置（不要展示PEEV/EBITDA、PEG (Forward)、Adj FCF Yield、ROIC、PEG (TTM)数据），分析短期和长期有什么不同价值"
+    "4. 需要综合市场份额、行业地位、资本支出、行业趋势等因素做出理性判断。"
+    "5. 不仅要看当下，更要用发展，向前看的视角对增长做出评估。"
+    "7. 最后必须给一些持仓建议，有必要的时候还要提示风险，不要给具体的目标价。"
+)
+AI_FAILURE_TEXT = "AI 策略生成超时或失败，请参考上方因子分析。"
+# FMP 成功端点占比不超过该值时，提示词大半是空值，不再调用 DeepSeek，直接使用规则策略
+MIN_AI_COVERAGE = 0.5
+DEEPSEEK_SYSTEM_MESSAGE = {"role": "system", "content": DEEPSEEK_SYSTEM_PROMPT}
+DEEPSEEK_PAYLOAD_BASE = {
+    "model": "deepseek-chat",
+    "temperature": 1.3, 
+    "max_tokens": 100,
+    "stream": True
+}
+DEEPSEEK_HEADERS = {
+    "Content-Type": "application/json",
+    "Authorization": f"Bearer {DEEPSEEK_API_KEY}"
+}
+
 @tenacity.retry(
     stop=tenacity.stop_after_attempt(3),
     wait=tenacity.wait_fixed(2), # 固定等待2秒，避免指数级等待太久导致Discord超时
     retry=tenacity.retry_if_exception_type((aiohttp.ClientError, asyncio.TimeoutError)),
     reraise=True 
 )
-async def ask_deepseek_strategy(session: aiohttp.ClientSession, ticker: str, model, semaphore: asyncio.Semaphore):
+async def ask_deepseek_strategy(session: aiohttp.ClientSession, ticker: str, model, semaphore: asyncio.Semaphore, on_partial=None):
     if not DEEPSEEK_API_KEY:
         return "DeepSeek API Key 未配置，无法生成智能策略。"
 
     # --- 1. 数据提取 ---
-    raw = model.data
-    p = raw.get("profile", {}) or {}
-    q = raw.get("quote", {}) or {}
-    r = raw.get("ratios", {}) or {}
-    m = raw.get("metrics", {}) or {}
-    g = raw.get("growth", {}) or {}
-    bs = raw.get("bs", {}) or {}
-    estimates = raw.get("estimates", []) or []
-    earnings = raw.get("earnings", []) or []
+    fetched = model.data
+    p = fetched.profile or {}
+    q = fetched.quote
+    r = fetched.ratios
+    m = fetched.metrics
+    g = fetched.growth
+    bs = fetched.bs
+    estimates = fetched.estimates
+    earnings = fetched.earnings
 
     price = p.get("price") or q.get("price") or 0
     high_52 = q.get("yearHigh", 0)
@@ -191,24 +442,21 @@ async def ask_deepseek_strategy(session: aiohttp.ClientSession, ticker: str, mod
 
     # 辅助：计算 PEG Forward (使用 2年 CAGR 修正版)
     peg_fwd_val = "N/A"
-    try:
-        if len(estimates) >= 2 and price:
-            today_str = datetime.now().strftime("%Y-%m-%d")
-            future_ests = sorted([e for e in estimates if e.get("date") > today_str], key=lambda x: x.get("date"))
-            if len(future_ests) >= 2:
-                eps1 = future_ests[0].get("epsAvg")
-                eps2 = future_ests[1].get("epsAvg")
-                if eps1 and eps1 > 0 and eps2 and eps2 > 0:
-                    fwd_pe = price / eps1
-                    # [修复] 2年 CAGR
-                    fwd_growth = (eps2 / eps1) ** 0.5 - 1
-                    if fwd_growth > 0:
-                        peg_fwd_val = round(fwd_pe / (fwd_growth * 100), 2)
-    except: pass
+    if len(estimates) >= 2 and price:
+        future_ests = get_future_estimates(estimates, today_ymd())
+        if len(future_ests) >= 2:
+            eps1 = future_ests[0].get("epsAvg")
+            eps2 = future_ests[1].get("epsAvg")
+            if eps1 and eps1 > 0 and eps2 and eps2 > 0:
+                fwd_pe = price / eps1
+                # [修复] 2年 CAGR
+                fwd_growth = (eps2 / eps1) ** 0.5 - 1
+                if fwd_growth > 0:
+                    peg_fwd_val = round(fwd_pe / (fwd_growth * 100), 2)
 
     earnings_list = []
     if earnings:
-        sorted_earning = sorted(earnings, key=lambda x: x.get("date", "0000-00-00"), reverse=True)[:4]
+        sorted_earning = heapq.nlargest(4, earnings, key=_record_date)
         for e in sorted_earning:
             d = e.get("date", "")[:7]
             rev = e.get("revenue", 0)
@@ -264,74 +512,79 @@ async def ask_deepseek_strategy(session: aiohttp.ClientSession, ticker: str, mod
         },
         "earnings_trend_4q": earnings_list,
         "sentiment_factors": {
-            "meme_score": model.data.get("meme_pct", 0),
+            "meme_score": model.meme_pct,
             "risk_var_95": model.risk_var,
             "short_term_verdict": model.short_term_verdict,
             "long_term_verdict": model.long_term_verdict
         }
     }
 
-    system_prompt = (
-        "你是一位拥有十年经验的资深美股交易员和华尔街机构分析师。你精通基本面分析、估值建模和市场情绪判断。"
-        "你需要阅读我提供的精简财务数据包。"
-        "请用**专业、科学、辩证**的角度评估这些数据。"
-        "**要求：**"
-        "1. 字数严格限制在50字以内，简明扼要。"
-        "2. 不能单靠一个pe得出结论，不能单凭股价在高位就说估值高（特别是7大科技，股价高不代表贵），需要结合EV/EBITDA、PEG (Forward)、Adj FCF Yield、ROIC、PEG (TTM)等多种数据交叉验证，用华尔街看数据的方法，得出一个合理的评估结论，就像华尔街机构晨报那样， 语言风格要通俗易懂且专业。"
-        "3. 用白话的形式告诉用户现在的股价是个什么位置（不要展示PEEV/EBITDA、PEG (Forward)、Adj FCF Yield、ROIC、PEG (TTM)数据），分析短期和长期有什么不同价值"
-        "4. 需要综合市场份额、行业地位、资本支出、行业趋势等因素做出理性判断。"
-        "5. 不仅要看当下，更要用发展，向前看的视角对增长做出评估。"
-        "7. 最后必须给一些持仓建议，有必要的时候还要提示风险，不要给具体的目标价。"
-    )
 
     try:
-        data_context = json.dumps(simplified_data, default=str)
+        data_context = orjson.dumps(simplified_data, default=str).decode()
     except Exception:
         data_context = "数据序列化失败"
 
     user_prompt = f"股票代码：{ticker}。这是该股票的精简API数据：\n{data_context}\n请根据上述数据生成一段策略评估。"
 
     payload = {
-        "model": "deepseek-chat",
-        "messages": [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ],
-        "temperature": 1.3, 
-        "max_tokens": 100,
-        "stream": False
+        **DEEPSEEK_PAYLOAD_BASE,
+        "messages": [DEEPSEEK_SYSTEM_MESSAGE, {"role": "user", "content": user_prompt}]
     }
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {DEEPSEEK_API_KEY}"
-    }
+    cache_key = (ticker.upper(), hashlib.blake2b(user_prompt.encode(), digest_size=16).digest())
+    if cache_key in AI_CACHE:
+        return AI_CACHE[cache_key]
 
     # 使用传入的 semaphore
-    async with semaphore: 
+    async with AI_LOCKS.lock(cache_key[0]), semaphore: 
+        if cache_key in AI_CACHE:
+            return AI_CACHE[cache_key]
         try:
-            async with session.post(DEEPSEEK_URL, json=payload, headers=headers, timeout=20) as response:
-                if response.status == 200:
-                    result = await response.json()
-                    content = result['choices'][0]['message']['content']
-                    return content.strip()
-                else:
-                    logger.error(f"DeepSeek API Error: {response.status}")
-                    if 500 <= response.status < 600:
-                          raise aiohttp.ClientError(f"Server Error {response.status}")
-                    return "AI 策略生成超时或失败，请参考上方因子分析。"
+            async with asyncio.timeout(20):
+                async with session.post(DEEPSEEK_URL, json=payload, headers=DEEPSEEK_HEADERS) as response:
+                    if response.status == 200:
+                        # SSE: 每行 "data: {json}"，以 "data: [DONE]" 结束
+                        chunks = []
+                        async for raw_line in response.content:
+                            line = raw_line.strip()
+                            if not line.startswith(b"data:"):
+                                continue
+                            frame = line[5:].strip()
+                            if frame == b"[DONE]":
+                                break
+                            delta = orjson.loads(frame)['choices'][0].get('delta', {}).get('content')
+                            if delta:
+                                chunks.append(delta)
+                                # 只登记最新文本，不在超时 / 锁 / 信号量内做任何 Discord IO
+                                if on_partial:
+                                    on_partial("".join(chunks))
+                        content = "".join(chunks).strip()
+                        if content:
+                            AI_CACHE[cache_key] = content
+                        return content
+                    else:
+                        logger.error("DeepSeek API Error: %s", response.status)
+                        if _is_retryable_status(response.status):
+                            raise RetryableHTTPError(response.status, response.headers.get("Retry-After"))
+                        return AI_FAILURE_TEXT
         except Exception as e:
-            logger.warning(f"DeepSeek Attempt Failed: {e}, retrying...")
+            logger.warning("DeepSeek Attempt Failed: %s, retrying...", e)
             raise e
 
 # --- 3. 辅助格式化函数 ---
 
+# type() 精确匹配比 isinstance 元组检查更快，同时顺带排除了 None / bool
+_NUMERIC_TYPES = (int, float)
+
 def format_percent(num):
-    return f"{num * 100:.2f}%" if num is not None and isinstance(num, (int, float)) else "N/A"
+    return f"{num * 100:.2f}%" if type(num) in _NUMERIC_TYPES else "N/A"
 
 def format_num(num):
-    return f"{num:.2f}" if num is not None and isinstance(num, (int, float)) else "N/A"
+    return f"{num:.2f}" if type(num) in _NUMERIC_TYPES else "N/A"
 
+# 同一只股票的市值/现金/负债在缓存期内不变，按值缓存格式化结果
+@functools.lru_cache(maxsize=1024)
 def format_market_cap(num):
     if num is None or num == 0: return "N/A"
     if num >= 1e12: return f"${num/1e12:.2f}T"
@@ -344,27 +597,146 @@ SECTOR_EBITDA_MEDIAN = {
     "Utilities": 12.0, "Unknown": 18.0
 }
 
+# 预先建好小写索引与单个正则，一次 search 完成板块匹配
+SECTOR_EBITDA_MEDIAN_LC = {k.lower(): v for k, v in SECTOR_EBITDA_MEDIAN.items()}
+SECTOR_RE = re.compile("|".join(map(re.escape, SECTOR_EBITDA_MEDIAN)), re.I)
+
 def get_sector_benchmark(sector):
     if not sector: return 18.0
-    for key in SECTOR_EBITDA_MEDIAN:
-        if key.lower() in str(sector).lower(): return SECTOR_EBITDA_MEDIAN[key]
-    return 18.0
+    match = SECTOR_RE.search(str(sector))
+    return SECTOR_EBITDA_MEDIAN_LC[match.group(0).lower()] if match else 18.0
+
+def _record_date(e):
+    return e.get("date") or "0000-00-00"
+
+def get_future_estimates(estimates, today_str, n=2):
+    # FMP 返回的 estimates 通常已按日期排好序：已升序时直接二分定位，
+    # 乱序时才排序副本，不会原地修改缓存中的列表
+    dates = [_record_date(e) for e in estimates]
+    if all(a <= b for a, b in zip(dates, dates[1:])):
+        ordered = estimates
+    else:
+        ordered = sorted(estimates, key=_record_date)
+        dates.sort()
+    idx = bisect.bisect_right(dates, today_str)
+    return ordered[idx:idx + n]
+
+# --- 成长档位 ---
+# 用整数档位代替对描述文字做子串判断；max_growth 严格大于阈值才升档 (bisect_left)
+GROWTH_LOW, GROWTH_STEADY, GROWTH_FAST, GROWTH_HYPER, GROWTH_EXPECTED = range(5)
+GROWTH_THRESH = (0.05, 0.2, 0.5)
+GROWTH_LABELS = ("低成长", "稳健", "高速", "超高速", "高预期")
+GROWTH_FAST_TIERS = frozenset((GROWTH_FAST, GROWTH_HYPER))
+GROWTH_FAST_OR_EXPECTED_TIERS = frozenset((GROWTH_FAST, GROWTH_HYPER, GROWTH_EXPECTED))
+
+# --- Meme 评分档位表 ---
+# bisect_left 统计严格小于取值的阈值个数，等价于原先逐级的 "> 阈值" 判断
+MEME_MA_THRESH = (1.15, 1.4)        # 现价 / 200日均线
+MEME_MA_SCORE = (0, 1, 2)
+MEME_PS_THRESH = (8, 10, 20)
+MEME_PS_SCORE = (0, 1, 2, 4)
+MEME_EV_THRESH = (30, 40, 80)
+MEME_EV_SCORE = (0, 1, 2, 4)
+MEME_BETA_THRESH = (1.3, 2.0)
+MEME_BETA_SCORE = (0, 1, 2)
+
+# --- 纯数值内核 ---
+# 只接收标量、不依赖 self，便于单独测试，将来做批量筛选时也可以直接向量化
+
+# 年化波动折算月度 (√(1/12)) 与单尾 95% 分位数
+MONTHLY_VOL_FACTOR = math.sqrt(1 / 12)
+Z_95 = 1.645
+
+def monthly_var_95(vix_val, beta):
+    # 用 VIX 隐含波动率 × Beta 估算个股年化波动，折算为月度 95% VaR (小数)
+    stock_annual_vol = (vix_val / 100.0) * beta
+    stock_monthly_vol = stock_annual_vol * MONTHLY_VOL_FACTOR
+    return Z_95 * stock_monthly_vol
+
+def score_meme(price, price_200ma, ps_ratio, ev_ebitda, beta, fcf_yield_api, peg_used, vol_today, vol_avg, roic) -> int:
+    meme_score = 0
+
+    # 1. 价格动量
+    if price and price_200ma:
+        meme_score += MEME_MA_SCORE[bisect.bisect_left(MEME_MA_THRESH, price / price_200ma)]
+
+    # 2. 估值炒作 (PS 或 EV/EBITDA 过高，取两者中较高的档位)
+    ps_val = ps_ratio if ps_ratio is not None else 0
+    evebitda_val = ev_ebitda if ev_ebitda is not None else 0
+    meme_score += max(
+        MEME_PS_SCORE[bisect.bisect_left(MEME_PS_THRESH, ps_val)],
+        MEME_EV_SCORE[bisect.bisect_left(MEME_EV_THRESH, evebitda_val)]
+    )
+    
+    # 3. 波动率 (Beta)
+    if beta:
+        meme_score += MEME_BETA_SCORE[bisect.bisect_left(MEME_BETA_THRESH, beta)]
+
+    # 4. 基本面背离 (价格高企但基本面差)
+    if price and price_200ma and price > price_200ma:
+        bad_fcf = (fcf_yield_api is not None and fcf_yield_api < 0.01)
+        bad_peg = (peg_used is not None and (peg_used < 0 or peg_used > 4.0))
+        
+        if bad_fcf or bad_peg: 
+            meme_score += 2
+    
+    # 5. 成交量异动
+    if vol_today and vol_avg and vol_avg > 0:
+        if vol_today > vol_avg * 1.2: 
+            meme_score += 1
+    
+    # 6. 质量折扣 (高ROIC且PEG合理则减分)
+    if roic and roic > 0.20:
+        if peg_used and 0 < peg_used < 3.0: 
+            meme_score -= 3
+        else: 
+            meme_score -= 1
+    
+    # 7. 归一化 (0-100%)
+    meme_score = max(0, min(10, meme_score))
+    return int(meme_score * 10)
 
 # --- 4. 估值模型类 ---
 
+# 各接口归一化后的数据：列表型接口为 list，单条记录型接口取首条为 dict
+@dataclass(slots=True)
+class FetchedData:
+    profile: Optional[dict] = None
+    treasury: Optional[dict] = None
+    quote: dict = field(default_factory=dict)
+    metrics: dict = field(default_factory=dict)
+    ratios: dict = field(default_factory=dict)
+    growth: dict = field(default_factory=dict)
+    bs: dict = field(default_factory=dict)
+    vix: dict = field(default_factory=dict)
+    cf: list = field(default_factory=list)
+    earnings: list = field(default_factory=list)
+    estimates: list = field(default_factory=list)
+
+FETCHED_LIST_KEYS = frozenset(["earnings", "estimates", "cf"])
+
 class ValuationModel:
+    __slots__ = (
+        "ticker", "data", "short_term_verdict", "long_term_verdict", "market_regime",
+        "risk_var", "meme_pct", "logs", "flags", "strategy", "fcf_yield_display", "fcf_yield_api", "coverage"
+    )
+    # 排查数据缺失时设置环境变量 DEBUG_EXTRACT=1，缺字段日志以 INFO 输出；默认完全不记录
+    VERBOSE_EXTRACT = bool(os.getenv("DEBUG_EXTRACT"))
+
     def __init__(self, ticker):
         self.ticker = ticker.upper()
-        self.data = {} 
+        self.data = FetchedData()
         self.short_term_verdict = "未知"
         self.long_term_verdict = "未知"
         self.market_regime = "未知"
         self.risk_var = "N/A"  
+        self.meme_pct = 0
         self.logs = []  
         self.flags = []  
         self.strategy = "数据不足"  
         self.fcf_yield_display = "N/A" 
         self.fcf_yield_api = None 
+        self.coverage = 0.0
 
     def extract(self, source, key, desc, default=None, required=True):
         val = source.get(key)
@@ -374,117 +746,144 @@ class ValuationModel:
             elif not required:
                 return None
             else:
-                logger.warning(f"[Missing] {desc} ({key}) is None!")
+                if self.VERBOSE_EXTRACT:
+                    logger.info("[Missing] %s (%s) is None!", desc, key)
                 return None
         else:
             return val
 
     async def fetch_data(self, session: aiohttp.ClientSession):
-        logger.info(f"--- Analysis Start: {self.ticker} ---")
-        task_profile = get_company_profile_smart(session, self.ticker)
-        task_treasury = get_treasury_rates(session)
+        logger.info("--- Analysis Start: %s ---", self.ticker)
+        cached_static = PROFILE_STATIC_CACHE.get(self.ticker)
+        profile_data = None
+        # 整体时间预算 15 秒；超时未返回的接口单独记为 None，其余结果照常使用
+        deadline = time.monotonic() + 15
+        if cached_static is None:
+            # 静态信息未缓存的 ticker 先只拉 profile + quote 验证代码有效，无效代码不再发出其余请求
+            # quote 成功后已写入 FMP_CACHE，下面第二阶段直接命中
+            profile_data, _ = await gather_within((
+                get_company_profile_smart(session, self.ticker),
+                get_fmp_data(session, "quote", self.ticker, "")
+            ), deadline - time.monotonic())
+            if profile_data is None:
+                logger.warning("[API Status] Profile unavailable for %s, remaining endpoints skipped.", self.ticker)
+                return False
         tasks_generic = {
             "quote": get_fmp_data(session, "quote", self.ticker, ""),
             "metrics": get_fmp_data(session, "key-metrics-ttm", self.ticker, ""),
             "ratios": get_fmp_data(session, "ratios-ttm", self.ticker, ""),
             "growth": get_fmp_data(session, "financial-growth", self.ticker, "period=annual&limit=1"),
-            "bs": get_fmp_data(session, "balance-sheet-statement", self.ticker, "limit=1"),
-            "cf": get_fmp_data(session, "cash-flow-statement", self.ticker, "period=quarter&limit=4"), 
-            "vix": get_fmp_data(session, "quote", "^VIX", ""),
+            "bs": get_fmp_data(session, "balance-sheet-statement", self.ticker, "limit=1", BS_KEEP),
+            "cf": get_fmp_data(session, "cash-flow-statement", self.ticker, "period=quarter&limit=4", CF_KEEP),
+            "vix": get_vix_quote(session),
             "earnings": get_earnings_data(session, self.ticker),
             "estimates": get_estimates_data(session, self.ticker)
         }
-        profile_data, treasury_data, *generic_results = await asyncio.gather(task_profile, task_treasury, *tasks_generic.values())
-        
-        self.data = dict(zip(tasks_generic.keys(), generic_results))
-        self.data["profile"] = profile_data 
-        self.data["treasury"] = treasury_data 
+        results = await gather_within(
+            (get_treasury_rates(session), *tasks_generic.values()), deadline - time.monotonic()
+        )
+        treasury_data, *generic_results = results
         
+        normalized = {"profile": profile_data, "treasury": treasury_data}
         success_keys = []
-        for k in tasks_generic.keys():
-            raw = self.data[k]
-            list_keys = ["earnings", "estimates", "cf"]
-            if k in list_keys:
-                if isinstance(raw, list) and len(raw) > 0:
-                    self.data[k] = raw
-                    success_keys.append(k)
-                else:
-                    self.data[k] = []
+        # 列表类接口保留整表，其余取首条记录；失败统一落为空容器
+        for k, raw in zip(tasks_generic.keys(), generic_results):
+            if k in FETCHED_LIST_KEYS:
+                ok = isinstance(raw, list) and len(raw) > 0
+                normalized[k] = raw if ok else []
+            elif isinstance(raw, list):
+                ok = len(raw) > 0
+                normalized[k] = raw[0] if ok else {}
             else:
-                if isinstance(raw, list) and len(raw) > 0:
-                    self.data[k] = raw[0]
-                    success_keys.append(k)
-                elif isinstance(raw, list) and len(raw) == 0:
-                    self.data[k] = {}
-                elif raw is None:
-                    self.data[k] = {}
-                else:
-                    success_keys.append(k)
+                ok = raw is not None
+                normalized[k] = raw if ok else {}
+            if ok:
+                success_keys.append(k)
+
+        # 静态信息命中缓存时，用 quote 拼出 profile；quote 缺失再回退到 profile 接口
+        if cached_static is not None:
+            q = normalized["quote"]
+            if q.get("price") is not None:
+                normalized["profile"] = {**cached_static, "price": q.get("price"), "mktCap": q.get("marketCap")}
+            else:
+                normalized["profile"] = await get_company_profile_smart(session, self.ticker)
+        elif normalized["profile"]:
+            PROFILE_STATIC_CACHE[self.ticker] = {k: normalized["profile"].get(k) for k in PROFILE_STATIC_FIELDS}
+
+        self.data = FetchedData(**normalized)
 
         total_endpoints = len(tasks_generic)
         failed_count = total_endpoints - len(success_keys)
-        logger.info(f"[API Status] Success: {len(success_keys)} | Failed: {failed_count} endpoints.")
-        return self.data["profile"] is not None
+        self.coverage = len(success_keys) / total_endpoints
+        logger.info("[API Status] Success: %d | Failed: %d endpoints.", len(success_keys), failed_count)
+        return self.data.profile is not None
 
     def analyze(self):
         try:
-            p = self.data.get("profile", {}) or {}
-            q = self.data.get("quote", {}) or {}
-            m = self.data.get("metrics", {}) or {} 
-            r = self.data.get("ratios", {}) or {}
-            g = self.data.get("growth", {}) or {} 
-            t = self.data.get("treasury", {}) or {} 
-            vix_data = self.data.get("vix", {}) or {}
-            earnings_raw = self.data.get("earnings", []) or []
-            cf_list = self.data.get("cf", []) or [] 
-            estimates = self.data.get("estimates", []) or []
-            bs = self.data.get("bs", {}) or {}
+            fetched = self.data
+            p = fetched.profile or {}
+            q = fetched.quote
+            m = fetched.metrics
+            r = fetched.ratios
+            g = fetched.growth
+            t = fetched.treasury or {}
+            vix_data = fetched.vix
+            earnings_raw = fetched.earnings
+            cf_list = fetched.cf
+            estimates = fetched.estimates
             
             if not p: return None
 
+            today_str = today_ymd()
+
             # === 1. 基础数据 ===
-            price = self.extract(q, "price", "Quote Price", default=p.get("price"))
-            price_200ma = self.extract(q, "priceAvg200", "200 Day MA", required=False)
-            sector = self.extract(p, "sector", "Sector", default="Unknown")
-            industry = self.extract(p, "industry", "Industry", default="Unknown")
-            beta = self.extract(p, "beta", "Beta", default=1.0)
-            m_cap = self.extract(q, "marketCap", "MarketCap", default=p.get("mktCap"))
+            # 只在字段缺失 (None) 时回退；FMP 对新上市股票返回的 beta=0 等真实 0 值必须保留
+            price = q.get("price")
+            if price is None: price = p.get("price")
+            price_200ma = q.get("priceAvg200")
+            sector = p.get("sector")
+            if sector is None: sector = "Unknown"
+            industry = p.get("industry")
+            if industry is None: industry = "Unknown"
+            beta = p.get("beta")
+            if beta is None: beta = 1.0
+            m_cap = q.get("marketCap")
+            if m_cap is None: m_cap = p.get("mktCap")
             
             # === 2. 财务指标 ===
-            ev_ebitda = self.extract(r, "enterpriseValueMultipleTTM", "EV/EBITDA", required=False)
+            ev_ebitda = r.get("enterpriseValueMultipleTTM")
             if ev_ebitda is None:
-                ev_ebitda = self.extract(m, "enterpriseValueOverEBITDATTM", "EV/EBITDA", required=False)
+                ev_ebitda = m.get("enterpriseValueOverEBITDATTM")
             
-            fcf_yield_api = self.extract(m, "freeCashFlowYieldTTM", "FCF Yield", required=False)
+            fcf_yield_api = m.get("freeCashFlowYieldTTM")
             self.fcf_yield_api = fcf_yield_api 
             
-            roic = self.extract(m, "returnOnInvestedCapitalTTM", "ROIC", required=False)
-            net_margin = self.extract(r, "netProfitMarginTTM", "Net Margin", required=False)
-            op_margin = self.extract(r, "operatingProfitMarginTTM", "Op Margin", required=False)
+            roic = m.get("returnOnInvestedCapitalTTM")
+            net_margin = r.get("netProfitMarginTTM")
+            op_margin = r.get("operatingProfitMarginTTM")
 
-            ps_ratio = self.extract(r, "priceToSalesRatioTTM", "P/S", required=False)
+            ps_ratio = r.get("priceToSalesRatioTTM")
             
-            peg_ttm = self.extract(r, "priceToEarningsGrowthRatioTTM", "PEG TTM", required=False)
-            pe_ttm = self.extract(r, "priceToEarningsRatioTTM", "PE TTM", required=False)
+            peg_ttm = r.get("priceToEarningsGrowthRatioTTM")
+            pe_ttm = r.get("priceToEarningsRatioTTM")
             
-            ni_growth = self.extract(g, "netIncomeGrowth", "NI Growth", required=False)
-            rev_growth = self.extract(g, "revenueGrowth", "Rev Growth", required=False)
+            ni_growth = g.get("netIncomeGrowth")
+            rev_growth = g.get("revenueGrowth")
 
             # 盈利检查
             eps_ttm = r.get("netIncomePerShareTTM") or m.get("netIncomePerShareTTM")
             latest_eps = 0
             
-            today_str = datetime.now().strftime("%Y-%m-%d")
-            past_earnings = []
-            if isinstance(earnings_raw, list):
-                past_earnings = [e for e in earnings_raw if e.get("date", "9999-99-99") <= today_str]
+            # 单次扫描取最近 12 个已发布季度 (按日期降序)，盈利检查与后面的业绩趋势共用
+            past_earnings = heapq.nlargest(
+                12, (e for e in earnings_raw if (e.get("date") or "9999-99-99") <= today_str), key=_record_date
+            )
             
             if past_earnings:
-                sorted_earnings_for_check = sorted(past_earnings, key=lambda x: x.get("date", "0000-00-00"), reverse=True)
-                latest_q = sorted_earnings_for_check[0]
+                latest_q = past_earnings[0]
                 val = latest_q.get("epsActual")
                 latest_eps = val if val is not None else 0
-                logger.info(f"[Earnings] Latest: {latest_q.get('date')} | EPS: {val}")
+                logger.info("[Earnings] Latest: %s | EPS: %s", latest_q.get("date"), val)
             else:
                 logger.info("[Earnings] No past earnings data found.")
 
@@ -494,48 +893,35 @@ class ValuationModel:
                 (op_margin is not None and op_margin > 0) and 
                 (net_margin is not None and net_margin > 0)
             )
-            
-            # 资产负债
-            cash = self.extract(bs, "cashAndCashEquivalents", "Cash", required=False, default=0)
-            debt = self.extract(bs, "totalDebt", "Total Debt", required=False, default=0)
-            is_cash_rich = (cash > debt) if (cash is not None and debt is not None) else False
 
-            logger.info(f"[Data Snapshot] Price: {price} | MCap: {format_market_cap(m_cap)} | Beta: {beta} | Sector: {sector}")
+            logger.info("[Data Snapshot] Price: %s | MCap: %s | Beta: %s | Sector: %s", price, format_market_cap(m_cap), beta, sector)
 
             # === 4. Forward PEG 计算 (修复版) ===
             forward_peg = None
             fwd_pe = None
             fwd_growth = None
             
-            if estimates and len(estimates) > 0 and price:
-                try:
-                    estimates.sort(key=lambda x: x.get("date", "0000-00-00"))
-                    future_estimates = [e for e in estimates if e.get("date", "") > today_str]
+            if estimates and price:
+                future_estimates = get_future_estimates(estimates, today_str)
+                if len(future_estimates) >= 2:
+                    eps_fy1 = future_estimates[0].get("epsAvg")
+                    eps_fy2 = future_estimates[1].get("epsAvg")
                     
-                    if len(future_estimates) >= 2:
-                        fy1 = future_estimates[0]; fy2 = future_estimates[1] 
-                        eps_fy1 = fy1.get("epsAvg"); eps_fy2 = fy2.get("epsAvg")
-                        
-                        if eps_fy1 is not None and eps_fy1 > 0 and eps_fy2 is not None and eps_fy2 > 0:
-                            fwd_pe = price / eps_fy1
-                            # 2年 CAGR
-                            fwd_growth = (eps_fy2 / eps_fy1) ** 0.5 - 1
-                            if fwd_growth > 0:
-                                forward_peg = fwd_pe / (fwd_growth * 100)
-                except Exception:
-                    pass
+                    if eps_fy1 is not None and eps_fy1 > 0 and eps_fy2 is not None and eps_fy2 > 0:
+                        fwd_pe = price / eps_fy1
+                        # 2年 CAGR
+                        fwd_growth = (eps_fy2 / eps_fy1) ** 0.5 - 1
+                        if fwd_growth > 0:
+                            forward_peg = fwd_pe / (fwd_growth * 100)
 
             peg_used = forward_peg if forward_peg is not None else peg_ttm
             is_forward_peg_used = (forward_peg is not None)
             
             # Growth Desc
-            growth_list = [x for x in [rev_growth, ni_growth, fwd_growth] if x is not None]
-            max_growth = max(growth_list) if growth_list else 0
-            growth_desc = "低成长"
-            if max_growth > 0.5: growth_desc = "超高速"
-            elif max_growth > 0.2: growth_desc = "高速"
-            elif max_growth > 0.05: growth_desc = "稳健"
-            if peg_used and peg_used > 3.0: growth_desc = "高预期"
+            max_growth = max((x for x in (rev_growth, ni_growth, fwd_growth) if x is not None), default=0)
+            growth_tier = bisect.bisect_left(GROWTH_THRESH, max_growth)
+            if peg_used and peg_used > 3.0: growth_tier = GROWTH_EXPECTED
+            growth_desc = GROWTH_LABELS[growth_tier]
             
             # === 5. Adjusted FCF Yield ===
             adj_fcf_yield = None
@@ -543,14 +929,14 @@ class ValuationModel:
                 ttm_cfo = 0
                 ttm_dep_amort = 0
                 quarter_count = 0
-                for i, q_data in enumerate(cf_list): 
-                    cfo_q = self.extract(q_data, "netCashProvidedByOperatingActivities", "CFO", required=False)
-                    dep_amort_q = self.extract(q_data, "depreciationAndAmortization", "D&A", required=False)
-                    if cfo_q is not None and dep_amort_q is not None:
-                        ttm_cfo += cfo_q
-                        ttm_dep_amort += dep_amort_q
-                        quarter_count += 1
-                    else: break 
+                # 单次遍历同时累加 CFO 与 D&A；任一季度缺数据即停止
+                for cf_q in cf_list:
+                    cfo_q = cf_q.get("netCashProvidedByOperatingActivities")
+                    dep_amort_q = cf_q.get("depreciationAndAmortization")
+                    if cfo_q is None or dep_amort_q is None: break
+                    ttm_cfo += cfo_q
+                    ttm_dep_amort += dep_amort_q
+                    quarter_count += 1
                 if ttm_cfo != 0 and quarter_count >= 4:
                     MAINTENANCE_CAPEX_RATIO = 0.5 
                     maintenance_capex = ttm_dep_amort * MAINTENANCE_CAPEX_RATIO
@@ -563,19 +949,17 @@ class ValuationModel:
                 self.fcf_yield_display = format_percent(fcf_yield_api) 
             
             # --- 赛道识别 ---
-            is_blue_ocean = False           
-            is_hard_tech_growth = False 
-            sec_str = str(sector).lower() if sector else ""
-            ind_str = str(industry).lower() if industry else ""
-            for kw in BLUE_OCEAN_KEYWORDS:
-                if kw in sec_str or kw in ind_str: is_blue_ocean = True; break
-            for kw in HARD_TECH_KEYWORDS:
-                if kw in sec_str or kw in ind_str: is_hard_tech_growth = True; break
+            sec_str = str(sector) if sector else ""
+            ind_str = str(industry) if industry else ""
+            # 用换行分隔，避免关键词跨越 sector/industry 拼接处误命中
+            sec_ind_str = f"{sec_str}\n{ind_str}"
+            is_blue_ocean = BLUE_OCEAN_RE.search(sec_ind_str) is not None
+            is_hard_tech_growth = HARD_TECH_RE.search(sec_ind_str) is not None
             if self.ticker in HARD_TECH_TICKERS:
                 if not is_blue_ocean: is_hard_tech_growth = True
 
             # --- 宏观利率 ---
-            yield_10y = self.extract(t, 'year10', "10Y Yield", required=False)
+            yield_10y = t.get('year10')
             macro_discount_factor = 1.0 
             macro_status_log = None
             is_growth_asset = is_blue_ocean or is_hard_tech_growth or (max_growth > 0.15) or (pe_ttm and pe_ttm > 30)
@@ -591,66 +975,17 @@ class ValuationModel:
             if macro_status_log: self.logs.append(macro_status_log)
 
             # --- VIX & VaR ---
-            vix_val = self.extract(vix_data, "price", "VIX", default=20)
+            vix_val = vix_data.get("price")
+            if vix_val is None: vix_val = 20
             if price and beta and vix_val:
-                stock_annual_vol = (vix_val / 100.0) * beta
-                stock_monthly_vol = stock_annual_vol / math.sqrt(12)
-                var_decimal = 1.645 * stock_monthly_vol
-                self.risk_var = f"-{var_decimal * 100:.1f}%"
+                self.risk_var = f"-{monthly_var_95(vix_val, beta) * 100:.1f}%"
             
             # --- Meme (NEW - Based on Image) ---
-            meme_score = 0
-            vol_today = self.extract(q, "volume", "Volume", required=False)
-            vol_avg = self.extract(q, "avgVolume", "Avg Volume", required=False)
-
-            # 1. 价格动量
-            if price and price_200ma:
-                if price > price_200ma * 1.4: 
-                    meme_score += 2
-                elif price > price_200ma * 1.15: 
-                    meme_score += 1
-
-            # 2. 估值炒作 (PS 或 EV/EBITDA 过高)
-            ps_val = ps_ratio if ps_ratio is not None else 0
-            evebitda_val = ev_ebitda if ev_ebitda is not None else 0
-            
-            if (ps_val > 20) or (evebitda_val > 80): 
-                meme_score += 4
-            elif (ps_val > 10) or (evebitda_val > 40): 
-                meme_score += 2
-            elif (ps_val > 8) or (evebitda_val > 30): 
-                meme_score += 1
-            
-            # 3. 波动率 (Beta)
-            if beta:
-                if beta > 2.0: 
-                    meme_score += 2
-                elif beta > 1.3: 
-                    meme_score += 1
-
-            # 4. 基本面背离 (价格高企但基本面差)
-            if price and price_200ma and price > price_200ma:
-                bad_fcf = (fcf_yield_api is not None and fcf_yield_api < 0.01)
-                bad_peg = (peg_used is not None and (peg_used < 0 or peg_used > 4.0))
-                
-                if bad_fcf or bad_peg: 
-                    meme_score += 2
-            
-            # 5. 成交量异动
-            if vol_today and vol_avg and vol_avg > 0:
-                if vol_today > vol_avg * 1.2: 
-                    meme_score += 1
-            
-            # 6. 质量折扣 (高ROIC且PEG合理则减分)
-            if roic and roic > 0.20:
-                if peg_used and 0 < peg_used < 3.0: 
-                    meme_score -= 3
-                else: 
-                    meme_score -= 1
-            
-            # 7. 归一化与信仰模式
-            meme_score = max(0, min(10, meme_score))
-            meme_pct = int(meme_score * 10)
+            meme_pct = score_meme(
+                price, price_200ma, ps_ratio, ev_ebitda, beta,
+                fcf_yield_api, peg_used, q.get("volume"), q.get("avgVolume"), roic
+            )
+            self.meme_pct = meme_pct
             is_faith_mode = meme_pct >= 50
 
             # === 9. 估值与策略判定 ===
@@ -677,7 +1012,7 @@ class ValuationModel:
                      self.logs.append(f"[预警] 自由现金流严重流失且无增长支撑。")
 
             if net_margin and net_margin > 0.20:
-                self.logs.append(f"[盈利质量] 净利率 ({format_percent(net_margin)}) 极高，展现出强大的产品定价权或成本控制力。")
+                self.logs.append(f"[盈利质量] 净利率 ({net_margin * 100:.2f}%) 极高，展现出强大的产品定价权或成本控制力。")
 
             is_giant = m_cap is not None and m_cap > 200_000_000_000
 
@@ -696,7 +1031,7 @@ class ValuationModel:
                         elif ps_ratio < th_fair: st_status = "合理 (P/S)"; ps_desc = "处于合理区间"
                         elif ps_ratio < th_high: st_status = "溢价 (P/S)"; ps_desc = "较高，市场给予了较高的增长溢价"
                         else: st_status = "过热 (P/S)"; ps_desc = "极高，价格已透支未来多年的增长"
-                        self.logs.append(f"{tag} P/S 估值：{format_num(ps_ratio)} ({ps_desc})。")
+                        self.logs.append(f"{tag} P/S 估值：{ps_ratio:.2f} ({ps_desc})。")
                         
                         if self.strategy == "数据不足":
                             if ps_ratio < th_fair:
@@ -706,34 +1041,34 @@ class ValuationModel:
 
                 elif ev_ebitda is not None:
                     ratio = ev_ebitda / sector_avg
-                    adjusted_ratio = ratio / macro_discount_factor if macro_discount_factor != 0 else ratio
+                    adjusted_ratio = ratio / macro_discount_factor  # 取值只有 0.7 / 1.0 / 1.5
                     
-                    if ("高速" in growth_desc or "预期" in growth_desc) and (peg_used is not None and 0 < peg_used < 1.5):
+                    if growth_tier in GROWTH_FAST_OR_EXPECTED_TIERS and (peg_used is not None and 0 < peg_used < 1.5):
                         st_status = "便宜 (高成长)"
-                        self.logs.append(f"[成长特权] 虽 EV/EBITDA ({format_num(ev_ebitda)}) 偏高，但 PEG ({format_num(peg_used)}) 极低，属于越涨越便宜。")
+                        self.logs.append(f"[成长特权] 虽 EV/EBITDA ({ev_ebitda:.2f}) 偏高，但 PEG ({peg_used:.2f}) 极低，属于越涨越便宜。")
                         if self.strategy == "数据不足":
                             self.strategy = "PEG极低且具备高成长属性，市场低估了其增长爆发力，属于极具性价比的进攻型标的。"
 
                     elif adjusted_ratio < 0.7:
                         st_status = "便宜"
-                        self.logs.append(f"[板块] EV/EBITDA ({format_num(ev_ebitda)}) 低于行业均值 ({sector_avg})，折扣明显。")
+                        self.logs.append(f"[板块] EV/EBITDA ({ev_ebitda:.2f}) 低于行业均值 ({sector_avg})，折扣明显。")
                         if self.strategy == "数据不足":
                             self.strategy = "当前估值显著低于行业平均水平，具备安全边际。建议关注是否有基本面改善的催化剂以修复估值。"
 
                     elif adjusted_ratio > 1.3:
-                        if ("高速" in growth_desc or "预期" in growth_desc) and (peg_used is not None and 0 < peg_used < 2.0):
+                        if growth_tier in GROWTH_FAST_OR_EXPECTED_TIERS and (peg_used is not None and 0 < peg_used < 2.0):
                             st_status = "合理溢价"
-                            self.logs.append(f"[成长特权] 高估值 ({format_num(ev_ebitda)}) 被高增长消化，溢价合理。")
+                            self.logs.append(f"[成长特权] 高估值 ({ev_ebitda:.2f}) 被高增长消化，溢价合理。")
                             if self.strategy == "数据不足":
                                 self.strategy = "高估值由高增长支撑，只要业绩增速维持，股价仍有上行空间，但需紧密跟踪财报。"
                         else:
                             st_status = "昂贵"
-                            self.logs.append(f"[板块] EV/EBITDA ({format_num(ev_ebitda)}) 远高于行业均值 ({sector_avg})，且缺乏增长支撑。")
+                            self.logs.append(f"[板块] EV/EBITDA ({ev_ebitda:.2f}) 远高于行业均值 ({sector_avg})，且缺乏增长支撑。")
                             if self.strategy == "数据不足":
                                 self.strategy = "当前估值显著高于行业水平，且缺乏极致的PEG或高ROIC支撑。此时买入缺乏安全边际，风险收益比不高，建议等待回调或业绩进一步兑现。"
                     else:
                         st_status = "估值合理"
-                        self.logs.append(f"[板块] EV/EBITDA ({format_num(ev_ebitda)}) 与行业均值 ({sector_avg}) 接近，估值处于合理区间。")
+                        self.logs.append(f"[板块] EV/EBITDA ({ev_ebitda:.2f}) 与行业均值 ({sector_avg}) 接近，估值处于合理区间。")
                         if self.strategy == "数据不足":
                             self.strategy = "当前估值处于合理区间，多空信号不明显。建议以持有观望为主，等待业绩驱动或更具吸引力的价格出现。"
             
@@ -752,7 +1087,7 @@ class ValuationModel:
             
             if not is_value_trap:
                 # PEG Log
-                peg_display = format_num(peg_used) if peg_used is not None else "N/A"
+                peg_display = f"{peg_used:.2f}" if peg_used is not None else "N/A"
                 peg_status = "N/A"
                 peg_comment = ""
                 peg_type_str = "Forward" if is_forward_peg_used else "TTM"
@@ -805,12 +1140,12 @@ class ValuationModel:
                 # FCF Logic
                 if fcf_yield_used is not None:
                     fcf_str = self.fcf_yield_display
-                    is_high_quality_growth = (("高速" in growth_desc or "超高速" in growth_desc or ("稳健" in growth_desc and roic is not None and roic > 0.20)) and roic is not None and roic > 0.15)
+                    is_high_quality_growth = ((growth_tier in GROWTH_FAST_TIERS or (growth_tier == GROWTH_STEADY and roic is not None and roic > 0.20)) and roic is not None and roic > 0.15)
                     is_adj_fcf_successful = adj_fcf_yield is not None
                     
                     if is_adj_fcf_successful and use_ps_valuation:
                         if fcf_yield_api is not None and adj_fcf_yield > (fcf_yield_api + 0.0005): 
-                            self.logs.append(f"[资本开支] Adj FCF Yield ({fcf_str}) 优于 原始 FCF ({format_percent(fcf_yield_api)})，反映出显著的**前置性资本投入**特征。")
+                            self.logs.append(f"[资本开支] Adj FCF Yield ({fcf_str}) 优于 原始 FCF ({fcf_yield_api * 100:.2f}%)，反映出显著的**前置性资本投入**特征。")
                             if adj_fcf_yield > 0.04: lt_status = "便宜"
                     
                     elif is_adj_fcf_successful and not use_ps_valuation:
@@ -820,9 +1155,9 @@ class ValuationModel:
                             if self.strategy == "数据不足": self.strategy = "当前价格具备较好的安全边际，存在价值投资的可能。"
                         elif fcf_yield_api is not None and adj_fcf_yield > (fcf_yield_api + 0.0005):
                             if roic and roic > 0.15:
-                                self.logs.append(f"[价值修正] Adj FCF Yield ({fcf_str}) 高于 原始 FCF ({format_percent(fcf_yield_api)})。结合极高的 **ROIC ({format_percent(roic)})**，说明巨额资本开支正高效转化为增长，高强度的扩张投入掩盖了其真实的现金流产生能力。")
+                                self.logs.append(f"[价值修正] Adj FCF Yield ({fcf_str}) 高于 原始 FCF ({fcf_yield_api * 100:.2f}%)。结合极高的 **ROIC ({roic * 100:.2f}%)**，说明巨额资本开支正高效转化为增长，高强度的扩张投入掩盖了其真实的现金流产生能力。")
                             else:
-                                self.logs.append(f"[价值修正] Adj FCF Yield ({fcf_str}) 高于 原始 FCF ({format_percent(fcf_yield_api)})，反映出增长性资本支出的积极影响。")
+                                self.logs.append(f"[价值修正] Adj FCF Yield ({fcf_str}) 高于 原始 FCF ({fcf_yield_api * 100:.2f}%)，反映出增长性资本支出的积极影响。")
 
                     if is_blue_ocean:
                         lt_status = "蓝海/战略卡位"
@@ -840,7 +1175,7 @@ class ValuationModel:
                         fcf_threshold = 0.01 if (roic and roic > 0.20) else 0.02
                         if fcf_yield_used < fcf_threshold and is_high_quality_growth and not is_faith_mode:
                             lt_status = "预期驱动/投资扩张"
-                            self.logs.append(f"[辩证] FCF Yield ({fcf_str}) 较低，但高增长/高ROIC ({format_percent(roic)}) 表明其 CapEx 多为**增长性投资**，当前估值是合理的增长溢价。")
+                            self.logs.append(f"[辩证] FCF Yield ({fcf_str}) 较低，但高增长/高ROIC ({roic * 100:.2f}%) 表明其 CapEx 多为**增长性投资**，当前估值是合理的增长溢价。")
                             if self.strategy == "数据不足":
                                 self.strategy = "基本面强劲，当前处于高投入换高增长阶段。投资逻辑应侧重于未来的业绩释放能力，而非当下的现金流回报。"
                         elif fcf_yield_used < fcf_threshold and not is_high_quality_growth and not is_faith_mode:
@@ -852,7 +1187,7 @@ class ValuationModel:
                     lt_status = "优质/值得等待"
                     has_value_fix_log = any("[价值修正]" in x for x in self.logs)
                     if not has_value_fix_log:
-                        self.logs.append(f"[辩证] ROIC ({format_percent(roic)}) 极高，属于'优质溢价'资产。")
+                        self.logs.append(f"[辩证] ROIC ({roic * 100:.2f}%) 极高，属于'优质溢价'资产。")
                     
                     if self.strategy == "数据不足" or "风险" in self.strategy or "高投入" in self.strategy:
                         is_peg_safe = peg_used is None or peg_used < 2.2 
@@ -875,29 +1210,24 @@ class ValuationModel:
                 if roic and roic > 0.15 and "昂贵" not in lt_status and not is_value_trap:
                     has_dialectic = any("[辩证]" in x or "[价值修正]" in x for x in self.logs)
                     if not has_dialectic:
-                        self.logs.append(f"[护城河] ROIC ({format_percent(roic)}) 优秀，资本效率高。")
+                        self.logs.append(f"[护城河] ROIC ({roic * 100:.2f}%) 优秀，资本效率高。")
                     if lt_status == "中性": lt_status = "优质"
                 
                 if fcf_yield_used is None and not use_ps_valuation:
                     self.logs.append(f"[预警] FCF Yield 数据缺失，无法进行基于现金流的长期估值。")
 
                 valid_earnings = []
-                today_str = datetime.now().strftime("%Y-%m-%d")
-                if isinstance(earnings_raw, list):
-                    sorted_earnings = sorted(earnings_raw, key=lambda x: x.get("date", "0000-00-00"), reverse=True)
-                    recent_earnings = sorted_earnings[:12]
-                    for e in recent_earnings:
-                        date = e.get("date")
-                        if date and date <= today_str:
-                            rev = self.extract(e, "revenueActual", "Revenue", default=e.get("revenue"))
-                            eps = self.extract(e, "epsActual", "EPS")
-                            est = self.extract(e, "epsEstimated", "EPS Est")
-                            
-                            if rev is not None and eps is not None:
-                                valid_earnings.append({"date": date, "rev": rev, "eps": eps, "est": est})
+                for e in past_earnings:
+                    rev = e.get("revenueActual")
+                    if rev is None: rev = e.get("revenue")
+                    eps = self.extract(e, "epsActual", "EPS")
+                    est = self.extract(e, "epsEstimated", "EPS Est")
+                    
+                    if rev is not None and eps is not None:
+                        valid_earnings.append({"date": e["date"], "rev": rev, "eps": eps, "est": est})
                 
-                trend_data = sorted(valid_earnings, key=lambda x: x["date"])
-                recent_4 = trend_data[-4:] 
+                # past_earnings 已按日期降序，取前 4 个再翻转为时间正序
+                recent_4 = valid_earnings[:4][::-1]
                 if len(recent_4) >= 3:
                     epss = [x["eps"] for x in recent_4]
                     if all(e < 0 for e in epss[:-1]) and epss[-1] > 0:
@@ -927,12 +1257,12 @@ class ValuationModel:
                 if pe_ttm and pe_ttm < 8 and rev_growth and rev_growth < -0.05 and "风险" not in lt_status:
                     self.strategy = "估值看似极低，但营收处于萎缩周期，需要警惕‘低估值陷阱’。"
                     lt_status = "周期性风险"
-                    self.logs.append(f"[陷阱] PE ({format_num(pe_ttm)}) 虽低，但营收负增长 ({format_percent(rev_growth)})，疑似周期顶部信号。")
+                    self.logs.append(f"[陷阱] PE ({pe_ttm:.2f}) 虽低，但营收负增长 ({rev_growth * 100:.2f}%)，疑似周期顶部信号。")
 
                 elif beta and beta < 0.6 and fcf_yield_used and fcf_yield_used > 0.03 and "陷阱" not in self.strategy:
                     self.strategy = "低波动防御性资产，可视为市场震荡环境下的潜在避险配置。"
                     lt_status = "防御/收息"
-                    self.logs.append(f"[防御] Beta ({format_num(beta)}) 极低且现金流健康，具备类似债券的特征。")
+                    self.logs.append(f"[防御] Beta ({beta:.2f}) 极低且现金流健康，具备类似债券的特征。")
 
             self.long_term_verdict = lt_status
 
@@ -948,7 +1278,7 @@ class ValuationModel:
                 "is_profitable": is_profitable_strict 
             }
         except Exception as e:
-            logger.error(f"Analyze Error: {e}")
+            logger.error("Analyze Error: %s", e)
             return None
 
 class AnalysisBot(commands.Bot):
@@ -959,16 +1289,38 @@ class AnalysisBot(commands.Bot):
         self.session: Optional[aiohttp.ClientSession] = None
         # 将信号量移入类中，防止全局变量污染
         self.deepseek_sem = asyncio.Semaphore(3)
+        self.analyze_pool: Optional[concurrent.futures.ThreadPoolExecutor] = None
 
     async def setup_hook(self):
         logger.info("Syncing commands...")
         await self.tree.sync() 
-        self.session = aiohttp.ClientSession()
+        # 连接池：同一主机保持足够的长连接，让一次分析的全部 FMP 请求真正并行
+        connector = aiohttp.TCPConnector(limit=64, limit_per_host=FMP_MAX_CONCURRENCY, ttl_dns_cache=300, keepalive_timeout=75)
+        # json= 请求体统一交给 orjson 编码 (aiohttp 要求返回 str)
+        # 整个进程只有这一个 session；新建 TCP 连接时打 DEBUG 日志，方便排查连接未被复用的情况
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(self._on_connection_create)
+        # 会话级兜底超时：建连 3 秒失败即交给重试；单次请求的总时限仍由各调用点的 asyncio.timeout 控制
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=30, sock_connect=3),
+            json_serialize=lambda obj: orjson.dumps(obj).decode(),
+            trace_configs=[trace_config]
+        )
+        # analyze() 是纯 CPU 计算，放到线程池里执行，避免阻塞事件循环
+        self.analyze_pool = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="analyze")
         logger.info("Commands synced & Session created.")
 
+    @staticmethod
+    async def _on_connection_create(session, trace_config_ctx, params):
+        logger.debug("[HTTP] New pooled connection opened.")
+
     async def close(self):
         if self.session:
             await self.session.close()
+        if self.analyze_pool:
+            self.analyze_pool.shutdown(wait=False)
+        FMP_DISK_CACHE.close()
         await super().close()
 
 bot = AnalysisBot()
@@ -982,6 +1334,53 @@ async def privacy(interaction: discord.Interaction):
     status = "已开启 (查询结果仅自己可见)" if new_state else "已关闭 (查询结果公开)"
     await interaction.response.send_message(f"[Info] 隐私模式切换成功。\n当前状态: **{status}**", ephemeral=True)
 
+# --- embed 描述档位表 ---
+# Meme: >= 30 / 60 / 80 依次升档
+MEME_DESC_THRESH = (30, 60, 80)
+MEME_DESC_LABELS = ("低关注度", "市场关注", "高流动性", "资金狂热")
+
+LOG_TAG_RE = re.compile(r"\[[^\]]*\]")
+
+def _fmt_log(log: str) -> str:
+    # "[标签]内容" -> "> **[标签]**内容"，其余原样加引用前缀
+    match = LOG_TAG_RE.match(log)
+    if match:
+        return f"> **{match.group()}**{log[match.end():]}"
+    return f"> {log}"
+
+async def send_public_status(interaction: discord.Interaction, ticker: str):
+    public_embed = discord.Embed(
+        description=f"**{interaction.user.display_name}** 开启《稳-量化估值系统》\n“{ticker.upper()}”分析报告已发送给用户✅",
+        color=0x2b2d31
+    )
+    try:
+        await interaction.channel.send(embed=public_embed) 
+    except Exception as e:
+        logger.error("Failed to send public status message: %s", e)
+
+async def get_analysis(client: "AnalysisBot", ticker: str, on_fetched=None) -> Tuple[bool, ValuationModel, Optional[dict]]:
+    # on_fetched: 数据拉取成功、analyze 开始之前回调 (同步)，用于让频道状态消息与 analyze 并行
+    assert client.session is not None, "bot.session 应在 setup_hook 中创建"
+    ticker_key = ticker.upper()
+    # 同一 ticker 的并发查询排队，后到的直接命中缓存
+    async with ANALYSIS_LOCKS.lock(ticker_key):
+        cached = ANALYSIS_CACHE.get(ticker_key)
+        if cached is None:
+            model = ValuationModel(ticker)
+            data = None
+            success = await model.fetch_data(client.session)
+            if success:
+                if on_fetched: on_fetched()
+                data = await asyncio.get_running_loop().run_in_executor(client.analyze_pool, model.analyze)
+                if data:
+                    ANALYSIS_CACHE[ticker_key] = (model, data)
+        else:
+            success = True
+            model, data = cached
+            if on_fetched: on_fetched()
+    # 后续流程会改写 model.strategy，缓存里保留原始快照
+    return success, copy.copy(model), data
+
 async def process_analysis(interaction: discord.Interaction, ticker: str, force_private: bool = False):
     # --- 1. 防刷检查 (Rate Limiting) ---
     is_limited, limit_msg = is_rate_limited(interaction.user.id)
@@ -994,37 +1393,48 @@ async def process_analysis(interaction: discord.Interaction, ticker: str, force_
     
     await interaction.response.defer(thinking=True, ephemeral=ephemeral_result) 
 
-    model = ValuationModel(ticker)
-    success = await model.fetch_data(interaction.client.session)
-    
-    if is_privacy_mode and success:
-        public_embed = discord.Embed(
-            description=f"**{interaction.user.display_name}** 开启《稳-量化估值系统》\n“{ticker.upper()}”分析报告已发送给用户✅",
-            color=0x2b2d31
-        )
-        try:
-            await interaction.channel.send(embed=public_embed) 
-        except Exception as e:
-            logger.error(f"Failed to send public status message: {e}")
+    cached_embed = EMBED_CACHE.get(ticker.upper())
+    if cached_embed is not None:
+        # 状态消息放到后台，缓存结果不必等一次 Discord 往返
+        status_task = asyncio.create_task(send_public_status(interaction, ticker)) if is_privacy_mode else None
+        await interaction.followup.send(embed=discord.Embed.from_dict(cached_embed), ephemeral=ephemeral_result)
+        if status_task: await status_task
+        return
+
+    # 频道状态消息与 analyze / DeepSeek 互不依赖：数据拉取成功后立即在后台发送
+    status_task = None
+
+    def start_status():
+        nonlocal status_task
+        if is_privacy_mode:
+            status_task = asyncio.create_task(send_public_status(interaction, ticker))
+
+    success, model, data = await get_analysis(interaction.client, ticker, start_status)
     
     if not success:
         await interaction.followup.send(f"[Error] 获取数据失败: `{ticker.upper()}`", ephemeral=ephemeral_result)
         return
 
-    data = model.analyze()
     if not data:
         await interaction.followup.send(f"[Warning] 数据不足。", ephemeral=ephemeral_result)
+        if status_task: await status_task
         return
 
-    try:
-        # 使用 AI 覆盖原本硬编码的 strategy
-        # 传入 bot.deepseek_sem
-        ai_strategy = await ask_deepseek_strategy(interaction.client.session, ticker, model, interaction.client.deepseek_sem)
-        if ai_strategy:
-            model.strategy = ai_strategy
-    except Exception as e:
-        logger.error(f"AI Strategy failed after retries: {e}")
-        model.strategy = "AI 服务暂时不可用，请参考上方因子分析。"
+    # DeepSeek 在后台运行，期间同步构建不依赖 AI 的 embed 字段
+    # 传入 bot.deepseek_sem
+    # 流式片段只写入 stream_state，由下方独立的更新任务按 1Hz 编辑消息
+    stream_state = {"partial": None}
+
+    def on_partial_strategy(partial: str):
+        stream_state["partial"] = partial
+
+    strategy_task = None
+    if model.coverage > MIN_AI_COVERAGE:
+        strategy_task = asyncio.create_task(
+            ask_deepseek_strategy(interaction.client.session, ticker, model, interaction.client.deepseek_sem, on_partial_strategy)
+        )
+    else:
+        logger.info("[AI] Skipped for %s: FMP coverage %.0f%%", model.ticker, model.coverage * 100)
 
     profit_label = "盈利" if data.get('is_profitable', False) else "亏损"
 
@@ -1034,26 +1444,23 @@ async def process_analysis(interaction: discord.Interaction, ticker: str, force_
         color=0x2b2d31
     )
 
-    verdict_text = (
-        f"> **短期:** {model.short_term_verdict}\n"
+    verdict_lines = (
+        f"> **短期:** {model.short_term_verdict}",
         f"> **长期:** {model.long_term_verdict}"
     )
-    embed.add_field(name="估值结论", value=verdict_text, inline=False)
+    embed.add_field(name="估值结论", value="\n".join(verdict_lines), inline=False)
 
     beta_val = data['beta']
     beta_desc = "低波动" if beta_val < 0.8 else ("高波动" if beta_val > 1.3 else "适中")
     
     meme_pct = data['meme_pct']
-    meme_desc = "低关注度"
-    if meme_pct >= 80: meme_desc = "资金狂热"
-    elif meme_pct >= 60: meme_desc = "高流动性"
-    elif meme_pct >= 30: meme_desc = "市场关注"
+    meme_desc = MEME_DESC_LABELS[bisect.bisect_right(MEME_DESC_THRESH, meme_pct)]
     
-    core_factors = (
-        f"> **Beta:** `{format_num(beta_val)}` ({beta_desc})\n"
+    core_lines = (
+        f"> **Beta:** `{beta_val:.2f}` ({beta_desc})",
         f"> **Meme值:** `{meme_pct}%` ({meme_desc})"
     )
-    embed.add_field(name="核心特征", value=core_factors, inline=False)
+    embed.add_field(name="核心特征", value="\n".join(core_lines), inline=False)
     
     if data['risk_var'] != "N/A":
         embed.add_field(
@@ -1062,40 +1469,83 @@ async def process_analysis(interaction: discord.Interaction, ticker: str, force_
             inline=False
         )
 
-    log_content = []
-    if model.flags: log_content.extend(model.flags) 
-    log_content.extend([f"{log}" for log in model.logs])
-    
-    formatted_logs = []
-    for log in log_content:
-        if log.startswith("[") and "]" in log:
-            tag_end = log.find("]") + 1
-            tag = log[:tag_end]
-            content = log[tag_end:]
-            formatted_logs.append(f"> **{tag}**{content}")
-        else:
-            formatted_logs.append(f"> {log}")
+    factor_str = "\n> \n".join(map(_fmt_log, itertools.chain(model.flags, model.logs)))
 
-    factor_str = "\n> \n".join(formatted_logs)
-    strategy_text = f"**[策略]** {model.strategy}"
-    full_log_str = f"{factor_str}\n{strategy_text}"
-    
-    if len(full_log_str) > 1000: full_log_str = full_log_str[:990] + "..."
+    def render_factor_field(strategy: str) -> str:
+        full_log_str = "\n".join((factor_str, f"**[策略]** {strategy}"))
+        if len(full_log_str) > 1000: full_log_str = full_log_str[:990] + "..."
+        return full_log_str
 
-    embed.add_field(name="因子分析", value=full_log_str, inline=False)
+    embed.add_field(name="因子分析", value=render_factor_field("AI 策略生成中..."), inline=False)
+    factor_field_idx = len(embed.fields) - 1
     embed.set_footer(text="(模型建议，仅作参考，不构成投资建议)")
 
-    await interaction.followup.send(embed=embed, ephemeral=ephemeral_result)
+    async def stream_updates(message):
+        # 在 DeepSeek 的超时、锁和信号量之外刷新，Discord 延迟或 429 退避不会挤占 LLM 的时间预算
+        shown = None
+        while True:
+            await asyncio.sleep(1.0)
+            partial = stream_state["partial"]
+            if not partial or partial == shown:
+                continue
+            shown = partial
+            embed.set_field_at(factor_field_idx, name="因子分析", value=render_factor_field(partial), inline=False)
+            try:
+                await message.edit(embed=embed)
+            except Exception as e:
+                logger.warning("Failed to stream strategy update: %s", e)
+
+    # 策略仍在生成时先发送占位结果，之后原地编辑；已就绪则在下方一次性发送
+    # 先给任务一个很短的窗口：AI_CACHE 命中、未配置 key 或立即失败时不必发占位再编辑
+    if strategy_task is not None:
+        await asyncio.wait({strategy_task}, timeout=0.3)
+    message = None
+    updater_task = None
+    if strategy_task is not None and not strategy_task.done():
+        message = await interaction.followup.send(embed=embed, ephemeral=ephemeral_result, wait=True)
+        updater_task = asyncio.create_task(stream_updates(message))
+
+    ai_ok = False
+    try:
+        # 使用 AI 覆盖原本硬编码的 strategy
+        ai_strategy = await strategy_task if strategy_task is not None else None
+        if ai_strategy:
+            model.strategy = ai_strategy
+            ai_ok = bool(DEEPSEEK_API_KEY) and ai_strategy != AI_FAILURE_TEXT
+    except Exception as e:
+        logger.error("AI Strategy failed after retries: %s", e)
+        model.strategy = "AI 服务暂时不可用，请参考上方因子分析。"
+    finally:
+        # 先停掉流式刷新，避免它在最终编辑之后再写回中间结果
+        if updater_task is not None:
+            updater_task.cancel()
+            await asyncio.gather(updater_task, return_exceptions=True)
+
+    embed.set_field_at(factor_field_idx, name="因子分析", value=render_factor_field(model.strategy), inline=False)
+    if ai_ok:
+        EMBED_CACHE[ticker.upper()] = embed.to_dict()
+
+    if message is None:
+        await interaction.followup.send(embed=embed, ephemeral=ephemeral_result)
+    else:
+        try:
+            await message.edit(embed=embed)
+        except Exception as e:
+            logger.error("Failed to finalize analysis message: %s", e)
+    if status_task: await status_task
 
-@bot.tree.command(name="analyze", description="估值分析 (结果可见性由/privacy决定)")
+# /analyze 与 /private_analyze 共用同一个回调，通过 command.extras 区分是否强制私密
 @app_commands.describe(ticker="股票代码 (如 NVDA)")
-async def analyze_command(interaction: discord.Interaction, ticker: str):
-    await process_analysis(interaction, ticker, force_private=False)
+async def analyze_callback(interaction: discord.Interaction, ticker: str):
+    await process_analysis(interaction, ticker, force_private=interaction.command.extras.get("force_private", False))
 
-@bot.tree.command(name="private_analyze", description="私密估值分析 (结果仅自己可见，但会在频道内发布状态)")
-@app_commands.describe(ticker="股票代码 (如 NVDA)")
-async def private_analyze_command(interaction: discord.Interaction, ticker: str):
-    await process_analysis(interaction, ticker, force_private=True)
+for _name, _description, _force_private in (
+    ("analyze", "估值分析 (结果可见性由/privacy决定)", False),
+    ("private_analyze", "私密估值分析 (结果仅自己可见，但会在频道内发布状态)", True),
+):
+    bot.tree.add_command(app_commands.Command(
+        name=_name, description=_description, callback=analyze_callback, extras={"force_private": _force_private}
+    ))
 
 if __name__ == "__main__":
     if not DISCORD_TOKEN:
@@ -1105,7 +1555,14 @@ if __name__ == "__main__":
              logger.error("FMP_API_KEY environment variable not set.")
         if not DEEPSEEK_API_KEY:
              logger.warning("DEEPSEEK_API_KEY not set, AI features will be disabled.")
+        # uvloop 仅支持 Linux/macOS；未安装时回退到默认事件循环
+        try:
+            import uvloop
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+            logger.info("Using uvloop event loop.")
+        except ImportError:
+            pass
         try:
             bot.run(DISCORD_TOKEN)
         except Exception as e:
-            logger.error(f"Bot failed to run: {e}")
+            logger.error("Bot failed to run: %s", e)